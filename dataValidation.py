@@ -0,0 +1,153 @@
+"""
+ Validacion y reparacion de registros vacios en los datos crudos (FNL, GFS_HD, GFS 0P25)
+ antes de preparar los forzamientos para NEMO-OPA.
+
+ Un registro (un instante de tiempo de una variable) se considera vacio cuando:
+  - Todos sus valores estan enmascarados.
+  - Contiene valores NaN.
+  - Todos sus valores son iguales (campo constante), solo si se pide para la variable (llave 'constcheck'
+    de gfsconfig.cfg). Por omision no se revisa: dswrfsfc es cero en toda la malla de noche y pratesfc
+    en dias secos, y son registros validos.
+
+ La deteccion se hace sobre el bloque temporal completo (tiempo, lat, lon) con reducciones
+ O(n) por registro (all, any, max, min), sin ordenar los datos.
+
+ Estrategias de reparacion (llave 'repair' de gfsconfig.cfg):
+  persistence : Se copia el registro valido anterior (o el siguiente, si no hay anterior).
+  linear      : Interpolacion lineal en tiempo entre el registro valido anterior y el siguiente.
+  cycle       : Se copia el registro valido mas cercano a la misma hora del dia (t +- n*cycle),
+                si no existe se usa persistence.
+
+"""
+
+import logging as log
+import numpy as np
+
+# Codigos de registros vacios.
+REC_OK = 0
+REC_MASKED = 1
+REC_NAN = 2
+REC_CONSTANT = 3
+
+recReasons = {REC_MASKED : 'enmascarado', REC_NAN : 'NaN', REC_CONSTANT : 'constante'}
+
+repairMethods = ['persistence', 'linear', 'cycle']
+
+
+def emptyRecords(stack, checkConst=False):
+    """
+     Revisa el bloque 'stack' (tiempo, ...) y regresa un arreglo de tamano 'tiempo' con el
+     codigo de cada registro: REC_OK, REC_MASKED, REC_NAN o REC_CONSTANT.
+     La revision de campos constantes solo se hace si 'checkConst' es True.
+    """
+    nt = stack.shape[0]
+    flags = np.zeros(nt, np.int8)
+    if nt == 0:
+        return flags
+
+    data = np.ma.getdata(stack).reshape(nt, -1)
+    mask = np.ma.getmask(stack)
+    if mask is not np.ma.nomask:
+        mask = mask.reshape(nt, -1)
+        if not mask.any():
+            mask = np.ma.nomask
+
+    if checkConst:
+        if mask is np.ma.nomask:
+            constRec = data.max(axis=1) == data.min(axis=1)
+        else:
+            mdata = np.ma.array(data, mask=mask)
+            constRec = np.ma.filled(mdata.max(axis=1) == mdata.min(axis=1), False)
+        flags[constRec] = REC_CONSTANT
+
+    if data.dtype.kind == 'f':
+        if mask is np.ma.nomask:
+            nanRec = np.isnan(data).any(axis=1)
+        else:
+            nanRec = (np.isnan(data) & ~mask).any(axis=1)
+        flags[nanRec] = REC_NAN
+
+    if mask is not np.ma.nomask:
+        flags[mask.all(axis=1)] = REC_MASKED
+
+    return flags
+
+
+def repairRecords(stack, flags, timeV=None, method='linear', cycle=8):
+    """
+     Repara, sobre el mismo arreglo 'stack' (numpy.ndarray, tiempo, ...), los registros marcados
+     en 'flags' (ver emptyRecords) con la estrategia 'method'.
+     'timeV' son los valores de tiempo de cada registro, se usan en la interpolacion lineal
+     (si es None se asume espaciado uniforme). 'cycle' es el numero de registros por dia.
+
+     Regresa una lista de reportes, uno por registro reparado:
+      [ {'index' : i, 'reason' : 'NaN', 'method' : 'linear', 'from' : (i0, i1)} , ... ]
+    """
+    if method not in repairMethods:
+        log.warning('repairRecords: Metodo de reparacion ' + str(method) + ' no es valido, se usara linear')
+        method = 'linear'
+
+    report = []
+    badI = np.flatnonzero(flags != REC_OK)
+    if badI.size == 0:
+        return report
+
+    goodI = np.flatnonzero(flags == REC_OK)
+    if goodI.size == 0:
+        log.error('repairRecords: No hay registros validos para reparar los registros vacios')
+        return report
+
+    if timeV is None:
+        timeV = np.arange(flags.size, dtype=np.float64)
+
+    # Registros validos anterior y siguiente de cada registro vacio.
+    pos = np.searchsorted(goodI, badI)
+    prevI = goodI[np.maximum(pos - 1, 0)]
+    nextI = goodI[np.minimum(pos, goodI.size - 1)]
+    hasPrev = pos > 0
+    hasNext = pos < goodI.size
+
+    for k, i in enumerate(badI):
+        used = method
+        if method == 'cycle':
+            src = None
+            for n in range(1, (flags.size // cycle) + 1):
+                for c in (i - n * cycle, i + n * cycle):
+                    if 0 <= c < flags.size and flags[c] == REC_OK:
+                        src = c
+                        break
+                if src is not None:
+                    break
+            if src is not None:
+                stack[i] = stack[src]
+                report.append({'index' : i, 'reason' : recReasons[flags[i]], 'method' : used, 'from' : (src,)})
+                continue
+            used = 'persistence'
+
+        if method == 'linear' and hasPrev[k] and hasNext[k]:
+            i0 = prevI[k]
+            i1 = nextI[k]
+            w = float(timeV[i] - timeV[i0]) / float(timeV[i1] - timeV[i0])
+            stack[i] = stack[i0] * (1.0 - w) + stack[i1] * w
+            report.append({'index' : i, 'reason' : recReasons[flags[i]], 'method' : used, 'from' : (i0, i1)})
+            continue
+
+        src = prevI[k] if hasPrev[k] else nextI[k]
+        stack[i] = stack[src]
+        report.append({'index' : i, 'reason' : recReasons[flags[i]], 'method' : 'persistence', 'from' : (src,)})
+
+    return report
+
+
+def logRepairReport(varName, report, timeV=None):
+    """
+     Escribe en el log el reporte de registros reparados de la variable 'varName'.
+    """
+    if len(report) == 0:
+        log.info('Variable ' + varName + ': sin registros vacios.')
+        return
+    log.warning('Variable ' + varName + ': ' + str(len(report)) + ' registros vacios reparados.')
+    for r in report:
+        tstr = (' (tiempo ' + str(timeV[r['index']]) + ')') if timeV is not None else ''
+        log.warning('  Registro ' + str(r['index']) + tstr + ' ' + r['reason'] + ', reparado con ' + r['method'] +
+                    ' desde ' + str(r['from']))
@@ -14,6 +14,7 @@
 
 import os 
 import glob
+import time
 import numpy as np
 import netCDF4 as nc 
 from scipy import interpolate 
@@ -21,6 +22,9 @@ import logging as log
 import datetime as dt
 # Own libs
 import nemoForcingMaker
+import dataValidation
+import sliceCache
+import timeMerge
 
 
 def findFNL_GFS(searchPath):
@@ -73,44 +77,59 @@ def doFNL_GFSForcing(fnlCrudos,gfsCrudos):
     xx = gfsData.variables['lon'][:] 
     yy = gfsData.variables['lat'][:] 
     
-    # Variable temporal de gfs y fnl, concatenadas. GFS viene @3hrs FNL @6hrs 
-    # Concatenamos @6hrs fnl + gfs_hd
+    # Variable temporal de gfs y fnl. GFS viene @3hrs FNL @6hrs 
+    # Unimos @6hrs fnl + gfs_hd, en tiempos repetidos gana fnl.
     timeVarFNL = fnlData.variables['time'][:] 
     timeVarGFS = gfsData.variables['time'][:]
-    timeFull = np.concatenate((timeVarFNL,timeVarGFS[0:timeVarGFS.size-1:2]))
+    merged = timeMerge.mergeSources([{'time' : timeVarFNL, 'priority' : 1}, {'time' : timeVarGFS, 'priority' : 0}], 6)
+    timeFull = merged['time']
+    posFNL, recFNL = timeMerge.sourceRecords(merged, 0)
+    posGFS, recGFS = timeMerge.sourceRecords(merged, 1)
     
     # Que variables vamos a interpolar:
     lVars = confData.getConfigValueVL('vars')
+    constCheck = confData.getConfigValueVL('constcheck')
+    repairM = getRepairMethod(confData)
     newVars = {}
     # Ciclo para interpolar todas las variables
     for var in lVars:
         
-        newVars[var] = np.zeros((timeFull.size , yyn.size , xxn.size))  
+        newVars[var] = np.zeros((timeFull.size , yyn.size , xxn.size), nemoForcingMaker.forcingDType)  
         if var != 'snodsfc':
-            n = 0 
+            flags = np.zeros(timeFull.size, np.int8)
             log.info('Llenando FNL variable: ' + var)
             # Lllenar de datos de FNL 
-            for t in range(0,timeVarFNL.size):
-                varData = fnlData.variables[var][t][:][:] 
-                newVars[var][n][:][:] = varData 
-                n = n + 1 
-                log.info('N : ' + str(n-1))
+            if recFNL.size > 0:
+                varData = fnlData.variables[var][recFNL]
+                flags[posFNL] = dataValidation.emptyRecords(varData, var in constCheck)
+                newVars[var][posFNL] = np.ma.filled(varData, 0)
                  
             # Llenar datos de GFS, con interpolacion
             log.info('Interpolado GFS variable : ' + var)
-            for t in range(0,timeVarGFS.size-1,2):
+            if recGFS.size > 0:
+                varData = gfsData.variables[var][recGFS]
+                gfsFlags = dataValidation.emptyRecords(varData, var in constCheck)
+            for j, (n, t) in enumerate(zip(posGFS, recGFS)):
                 log.info('Tiempo ' + str(t))
+                tData = varData[j]
+                # Un registro GFS_HD vacio (ver 'constcheck') se sustituye por el siguiente si este es valido,
+                # si no se repara despues, junto con los demas registros vacios.
+                if gfsFlags[j] != dataValidation.REC_OK:
+                    nextData = gfsData.variables[var][t+1:t+2]
+                    if nextData.shape[0] > 0 and dataValidation.emptyRecords(nextData, var in constCheck)[0] == dataValidation.REC_OK:
+                        tData = nextData[0]
+                        log.info('Tiempo vacio, se tomara el tiempo siguiente!!')
+                    else:
+                        flags[n] = gfsFlags[j]
+                        continue
             
-                varData = gfsData.variables[var][t][:][:]
-                if np.unique(varData).size == 1:
-                    varData = gfsData.variables[var][t+1][:][:]
-                    log.info('Tiempo vacio, se tomara el tiempo siguiente!!')
-                
-                funcInterpol = interpolate.RectBivariateSpline(yy,xx,varData)  
+                funcInterpol = interpolate.RectBivariateSpline(yy,xx,np.ma.filled(tData, 0))  
                 varDatanew =  funcInterpol(yyn,xxn)
                 newVars[var][n][:][:] = varDatanew 
-                n = n + 1
-                log.info('N : ' + str(n-1))
+                log.info('N : ' + str(n))
+
+            report = dataValidation.repairRecords(newVars[var], flags, timeFull, repairM, 4)
+            dataValidation.logRepairReport(var, report, timeFull)
         else:
             log.info('Dejamos snodsfc con ceros.')
             
@@ -120,10 +139,40 @@ def doFNL_GFSForcing(fnlCrudos,gfsCrudos):
     
     # Utilizar los scripts para generar archivos mensuales o anuales de los forzamientos
     myForc = nemoForcingMaker.nemoForcing() 
-    myForc.makeForcingCoreBulk( {'time' : timeFull, 'lat' : yyn, 'lon': xxn}, newVars, 'yearly' )
+    myForc.makeForcingCoreBulk( {'time' : timeFull, 'lat' : yyn, 'lon': xxn}, newVars, 6, getFileSize(confData) )
     
     return 0    
 
+def getRepairMethod(confData):
+    """
+     Regresa la estrategia de reparacion de registros vacios del archivo de configuracion
+     (llave 'repair'), por omision 'linear'.
+    """
+    repairM = confData.getConfigValue('repair').strip()
+    if repairM == '':
+        repairM = 'linear'
+    return repairM
+
+def getSliceCache(confData):
+    """
+     Regresa el cache de dias historicos (sliceCache) configurado en la llave 'cachedir',
+     o None si no se configuro.
+    """
+    cacheDir = confData.getConfigValue('cachedir').strip()
+    if cacheDir == '':
+        return None
+    cacheSize = confData.getConfigValue('cachesize').strip()
+    return sliceCache.sliceCache(cacheDir, int(cacheSize) if cacheSize != '' else 2000)
+
+def getFileSize(confData):
+    """
+     Regresa el periodo de los archivos de forzamientos (llave 'filesize'), por omision 'yearly'.
+    """
+    sFileSize = confData.getConfigValue('filesize').strip()
+    if sFileSize == '':
+        sFileSize = 'yearly'
+    return sFileSize
+
 def matlabDatenumToDatetime(value):
     return dt.datetime.fromordinal(int(value)) + dt.timedelta(days=value%1) - dt.timedelta(days = 366)
 
@@ -146,6 +195,19 @@ def selDRange(dst, dFrom, dTo):
 
     return np.argwhere((timeV >= fromNum) & (timeV < toNum)).flatten() 
 
+def readRecords(dst, dInd, lVars, constCheck):
+    """
+     Lee en bloque los registros 'dInd' de las variables 'lVars' del dataset dst.
+     Regresa (timeV, {'var' : datos (numpy.ma, como vienen del archivo)}, {'var' : banderas de registros vacios}).
+    """
+    data = {}
+    flags = {}
+    for var in lVars:
+        varData = dst.variables[var][dInd]
+        flags[var] = dataValidation.emptyRecords(varData, var in constCheck)
+        data[var] = varData
+    return dst.variables['time'][dInd], data, flags
+
 def getDFile(rawDPath,pDate, dataWildC):
     dtPathW = os.path.join(rawDPath, pDate.strftime('%Y%m%d') , dataWildC) 
     dtFPath = glob.glob(dtPathW) 
@@ -168,88 +230,197 @@ def doGFScore_bulk(rawDPath, dataWildC, pivotDate, hdays):
         dst = nc.Dataset(dtFile,'r') 
         yyn = dst.variables['lat'][:]
         xxn = dst.variables['lon'][:] 
-        timeSize = dst.variables['time'][:].size
+        pivotTime = dst.variables['time'][:]
         dst.close()
     else:
         log.error('El archivo con el dataset para la fecha ' + str(pivotDate) + ' no se encontro. Abortando')
         return -1 
 
 
-    # time variable
-
     # Que variables procesar.
     lVars = confData.getConfigValueVL('vars') 
-    newVars = {}
-    # Iniciar el tamano de los arreglos.
-    for var in lVars:
-        newVars[var] = np.zeros((timeSize + (hdays * 8) , yyn.size , xxn.size ))
-    # Time variable
-    timeFull = np.zeros((timeSize + (hdays * 8)))
-    log.info('Buffer para variables con tamano: ' + str(timeFull.size) )
-    log.info('Malla 2D shape: ' + str(yyn.size ) + ' , ' + str(xxn.size )  )
+    constCheck = confData.getConfigValueVL('constcheck')
+    dCache = getSliceCache(confData)
 
-
-    nI = 0
-    # Iniciar los arreglos con los hdays
+    # Fuentes de datos: un dia de cada archivo de los hdays (del cache si ya se extrajo antes) y el
+    # pronostico completo del archivo "pivotDate". En tiempos repetidos gana el archivo mas reciente.
+    sources = []
     for d in range(hdays,0,-1): 
         dtC = pivotDate - dt.timedelta(days=d) 
         dtFPath = getDFile(rawDPath, dtC, dataWildC)
         if (dtFPath):   
             log.info('Obteniendo datos de archivo : ' + str(dtFPath) + '  Buscando fecha: ' + str(dtC))                 
-            dst = nc.Dataset(dtFPath, 'r') 
-
-            # Seleccionar un dia del dataset historico
-            dInd = selDRange(dst, dtC , dtC+dt.timedelta(days=1)) 
-            log.info('Obteniendo de indices: ' +str(dInd))
-            for i in dInd:
-                for var in lVars:
-                    if (type(dst.variables[var][i][:][:]) is np.ma.MaskedArray):
-                        if not dst.variables[var][i][:][:].mask.all():
-                            newVars[var][nI][:][:] = dst.variables[var][i][:][:].filled(0) 
-                        else: 
-                            # All values in array are masked, this means that the register is empty, what to do? 
-                            newVars[var][nI][:][:] = dst.variables[var][i][:][:].filled(0)
-                    else:
-                        newVars[var][nI][:][:] = dst.variables[var][i][:][:]
-                timeFull[nI] = dst.variables['time'][i]
-                nI = nI + 1 
-
-            dst.close()
+            cached = dCache.get(dtFPath, dtC, lVars) if dCache else None
+            if cached:
+                sources.append({'file' : dtFPath, 'date' : dtC, 'time' : cached[0], 'priority' : dtC.toordinal(), 'cached' : cached})
+            else:
+                dst = nc.Dataset(dtFPath, 'r') 
+                dInd = selDRange(dst, dtC , dtC+dt.timedelta(days=1)) 
+                log.info('Obteniendo de indices: ' +str(dInd))
+                sources.append({'file' : dtFPath, 'date' : dtC, 'time' : dst.variables['time'][dInd], 'priority' : dtC.toordinal(), 'index' : dInd})
+                dst.close()
         else:
             log.info('No se encontro archivo para datos con fecha: ' + str(dtC))
 
+    sources.append({'file' : dtFile, 'date' : pivotDate, 'time' : pivotTime, 'priority' : pivotDate.toordinal(), 'index' : np.arange(pivotTime.size)})
 
-    # Agregar la informacion del pronostico que contenga el dataset "pivotDate" 
-    # 
-    dtFile = getDFile(rawDPath, pivotDate, dataWildC)
-    if (dtFile):
-        dst = nc.Dataset(dtFile,'r')
-        log.info('Obteniendo datos de archivo : ' + str(dtFile))
+    # Eje temporal final y registros que sobreviven de cada fuente.
+    merged = timeMerge.mergeSources(sources)
+    timeFull = merged['time']
+    newVars = {}
+    flags = {}
+    # Iniciar el tamano de los arreglos.
+    for var in lVars:
+        newVars[var] = np.zeros((timeFull.size , yyn.size , xxn.size ), nemoForcingMaker.forcingDType)
+        flags[var] = np.zeros((timeFull.size), np.int8)
+    log.info('Buffer para variables con tamano: ' + str(timeFull.size) )
+    log.info('Malla 2D shape: ' + str(yyn.size ) + ' , ' + str(xxn.size )  )
 
-        for tI in range(0,timeSize): 
+    # Una sola lectura en bloque por fuente, solo de los registros que sobreviven.
+    for k, src in enumerate(sources):
+        pos, rec = timeMerge.sourceRecords(merged, k)
+        if pos.size == 0:
+            continue
+        if 'cached' in src:
+            timeV, dData = src['cached']
             for var in lVars:
-                if (type(dst.variables[var][tI][:][:]) is np.ma.MaskedArray):
-                    if not dst.variables[var][tI][:][:].mask.all():
-                        newVars[var][nI][:][:] = dst.variables[var][tI][:][:].filled(0) 
-                    else:
-                        # All values in array are masked, this means that the register is empty, what to do? 
-                        newVars[var][nI][:][:] = dst.variables[var][tI][:][:].filled(0) 
-                else:
-                    newVars[var][nI][:][:] = dst.variables[var][tI][:][:] 
-            timeFull[nI] = dst.variables['time'][tI] 
-            nI = nI + 1 
-
+                varData = dData[var][rec]
+                flags[var][pos] = dataValidation.emptyRecords(varData, var in constCheck)
+                newVars[var][pos] = np.ma.filled(varData, 0)
+            continue
+
+        log.info('Obteniendo ' + str(rec.size) + ' registros de archivo : ' + str(src['file']))
+        dst = nc.Dataset(src['file'], 'r')
+        fInd = src['index'][rec]
+        timeV, dData, dFlags = readRecords(dst, fInd, lVars, constCheck)
+        for var in lVars:
+            flags[var][pos] = dFlags[var]
+            newVars[var][pos] = np.ma.filled(dData[var], 0)
+
+        # Guardar en el cache el dia de la fecha del archivo, si se leyo completo, para las corridas siguientes.
+        if dCache:
+            dInd = selDRange(dst, src['date'], src['date'] + dt.timedelta(days=1))
+            if dInd.size > 0 and np.in1d(dInd, fInd).all():
+                j = np.searchsorted(fInd, dInd)
+                dCache.put(src['file'], src['date'], timeV[j], dict([(v, dData[v][j]) for v in lVars]))
         dst.close()
 
+    # Reparar los registros vacios (enmascarados, NaN o constantes) de cada variable.
+    repairM = getRepairMethod(confData)
+    for var in lVars:
+        report = dataValidation.repairRecords(newVars[var], flags[var], timeFull, repairM, 8)
+        dataValidation.logRepairReport(var, report, timeFull)
+
 
     # Utilizar los scripts para generar archivos mensuales o anuales de los forzamientos
     myForc = nemoForcingMaker.nemoForcing() 
-    out = myForc.makeForcingCoreBulk( {'time' : timeFull, 'lat' : yyn, 'lon': xxn}, newVars, 3 , 'yearly' )
+    out = myForc.makeForcingCoreBulk( {'time' : timeFull, 'lat' : yyn, 'lon': xxn}, newVars, 3 , getFileSize(confData) )
 
     return out
 
 
 
+def scanDFiles(rawDPath, dataWildC):
+    """
+     Busca en rawDPath los archivos crudos con la estructura de getDFile (<YYYYMMDD>/dataWildC).
+     Regresa un <python dict> { fecha(datetime) : (ruta, (tamano, mtime)) }
+    """
+    found = {}
+    if not os.path.isdir(rawDPath):
+        return found
+    for dName in os.listdir(rawDPath):
+        try:
+            pDate = dt.datetime.strptime(dName, '%Y%m%d')
+        except ValueError:
+            continue
+        dtFPath = getDFile(rawDPath, pDate, dataWildC)
+        if (dtFPath):
+            try:
+                st = os.stat(dtFPath)
+            except OSError:
+                continue
+            found[pDate] = (dtFPath, (st.st_size, st.st_mtime))
+    return found
+
+def affectedPivots(newDates, availDates, hdays):
+    """
+     Fechas pivote que hay que procesar por la llegada de los archivos 'newDates'.
+     Un archivo nuevo de fecha D afecta la corrida del pivote mas reciente disponible en [D, D+hdays],
+     pues esa corrida es la que contiene a D en su ventana historica o como pronostico.
+    """
+    pivots = set()
+    for dNew in newDates:
+        cand = [ d for d in availDates if dNew <= d <= dNew + dt.timedelta(days=hdays) ]
+        if len(cand) > 0:
+            pivots.add(max(cand))
+    return sorted(pivots)
+
+def watchGFScore_bulk(rawDPath, dataWildC, hdays, pollSec=60, stablePolls=2, fromDate=None, maxPolls=None):
+    """
+     Modo de vigilancia: revisa cada 'pollSec' segundos el directorio rawDPath y en cuanto un archivo
+     crudo termina de llegar (tamano y fecha de modificacion sin cambios durante 'stablePolls' revisiones
+     y se puede abrir como netCDF) se ejecuta doGFScore_bulk solo para los pivotes que afecta.
+     Si un pivote falla (o lanza una excepcion) se registra en el log y sus archivos se reintentan en
+     la siguiente revision, sin detener la vigilancia.
+
+     Los archivos con fecha anterior a 'fromDate' se consideran ya procesados. Si 'fromDate' es None,
+     todos los archivos existentes al iniciar se consideran ya procesados.
+     'maxPolls' limita el numero de revisiones (None para vigilar indefinidamente).
+    """
+    confData = nemoForcingMaker.gfsConfig()
+    done = {}
+    seen = {}
+    stable = {}
+    for pDate, (dtFPath, st) in scanDFiles(rawDPath, dataWildC).items():
+        if fromDate is None or pDate < fromDate:
+            done[pDate] = st
+    log.info('Vigilando ' + os.path.join(rawDPath, '<YYYYMMDD>', dataWildC) + ', ' + str(len(done)) + ' archivos previos.')
+
+    polls = 0
+    try:
+        while maxPolls is None or polls < maxPolls:
+            current = scanDFiles(rawDPath, dataWildC)
+            ready = []
+            for pDate, (dtFPath, st) in current.items():
+                if done.get(pDate) == st:
+                    continue
+                stable[pDate] = (stable.get(pDate, 0) + 1) if seen.get(pDate) == st else 0
+                seen[pDate] = st
+                if stable[pDate] >= stablePolls and confData.datasetExists(dtFPath):
+                    log.info('Archivo completo: ' + dtFPath)
+                    ready.append(pDate)
+
+            if len(ready) > 0:
+                availDates = [ d for d in current.keys() if d in done or d in ready ]
+                failed = []
+                for pivot in affectedPivots(ready, availDates, hdays):
+                    log.info('Procesando pivote ' + str(pivot))
+                    try:
+                        out = doGFScore_bulk(rawDPath, dataWildC, pivot, hdays)
+                    except Exception:
+                        log.exception('Error al procesar el pivote ' + str(pivot))
+                        out = -1
+                    if out != 0:
+                        log.error('Fallo el procesamiento del pivote ' + str(pivot) + ', se reintentara en la siguiente revision.')
+                        failed.append(pivot)
+                # Las fechas cuyo pivote fallo no se marcan como procesadas, para reintentarlas.
+                for pDate in ready:
+                    if any([ p in failed for p in affectedPivots([pDate], availDates, hdays) ]):
+                        continue
+                    done[pDate] = current[pDate][1]
+                    del seen[pDate]
+                    del stable[pDate]
+
+            polls = polls + 1
+            if maxPolls is None or polls < maxPolls:
+                time.sleep(pollSec)
+    except KeyboardInterrupt:
+        log.info('Vigilancia terminada por el usuario.')
+
+    return 0
+
+
+
 
 def main():
     # Test main.
@@ -258,6 +429,7 @@ def main():
     # findFNL_GFS('.')
     dd = dt.datetime(2015,1,27)
     doGFScore_bulk('/LUSTRE/hmedrano/STOCK/FORCING-RAW/GFS_RAW','*0P25*.nc', dd , 5)
+    #watchGFScore_bulk('/LUSTRE/hmedrano/STOCK/FORCING-RAW/GFS_RAW','*0P25*.nc', 5)
 
 
 
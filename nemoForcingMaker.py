@@ -9,11 +9,14 @@
                o anuales.
              : La variable de dimension temporal que se le agrega a los archivos de forzamientos
                se genera con el metodo dateToNemoCalendar. 
+  2026-10-19 : makeForcingCoreBulk calcula primero las particiones de salida (diarias, semanales,
+               mensuales o anuales) y las escribe en paralelo. El nombre de los archivos es configurable.
 
 """
 
 import os
 import logging as log
+import multiprocessing
 from ConfigParser import ConfigParser
 import netCDF4 as nc 
 import numpy as np 
@@ -164,6 +167,165 @@ class nemoForcing(gfsConfig):
     def mtDToDatetime(self, dataOrd):
         return dt.datetime.fromordinal(int(dataOrd)) + dt.timedelta(days=dataOrd%1) - dt.timedelta(days=1)
 
+    def forcingPartitions(self, timeVals, sFileSize='yearly', sCalendarType='noleap'):
+        """
+         Calcula, antes de escribir, todas las particiones (archivos de salida) que cubren los valores
+         de tiempo 'timeVals'. 'sFileSize' puede ser 'daily', 'weekly', 'monthly' o 'yearly', cualquier
+         otro valor se toma como 'monthly'.
+
+         Regresa un <python list> de <python dict>, una por periodo, en orden:
+          { 'key'    : llave unica del periodo (incluye el ano),
+            'label'  : etiqueta para el nombre del archivo (y2015, y2015_M01, y2015_W05, y2015_M01_D27),
+            'ds'     : primer instante del periodo (datetime),
+            'ndays'  : dias del periodo, segun el calendario 'sCalendarType',
+            'i0','i1': rango de indices [i0, i1) de timeVals que pertenecen al periodo }
+        """
+        if sFileSize not in partitionTypes:
+            sFileSize = 'monthly'
+        parts = []
+        for idx_tval, tval in enumerate(timeVals):
+            tvaldate = self.mtDToDatetime(tval)
+            if sFileSize == 'yearly':
+                key = (tvaldate.year,)
+                label = 'y' + str(tvaldate.year)
+                ds = dt.datetime(tvaldate.year, 1, 1)
+            elif sFileSize == 'monthly':
+                key = (tvaldate.year, tvaldate.month)
+                label = 'y' + str(tvaldate.year) + '_M' + ("%02d" % tvaldate.month)
+                ds = dt.datetime(tvaldate.year, tvaldate.month, 1)
+            elif sFileSize == 'weekly':
+                isoy, isow, isod = tvaldate.isocalendar()
+                key = (isoy, isow)
+                label = 'y' + str(isoy) + '_W' + ("%02d" % isow)
+                ds = dt.datetime(tvaldate.year, tvaldate.month, tvaldate.day) - dt.timedelta(days=isod - 1)
+            else:
+                key = (tvaldate.year, tvaldate.month, tvaldate.day)
+                label = 'y' + str(tvaldate.year) + '_M' + ("%02d" % tvaldate.month) + '_D' + ("%02d" % tvaldate.day)
+                ds = dt.datetime(tvaldate.year, tvaldate.month, tvaldate.day)
+
+            if len(parts) > 0 and parts[-1]['key'] == key:
+                parts[-1]['i1'] = idx_tval + 1
+                continue
+
+            # Tamano de la dimension temporal de este periodo, segun el calendario que se utilize
+            if sFileSize == 'yearly':
+                ndays = int(self.dateToNemoCalendar(tvaldate, sCalendarType, 'yearLen'))
+            elif sFileSize == 'monthly':
+                ndays = int(self.dateToNemoCalendar(tvaldate, sCalendarType, 'monthLen'))
+            elif sFileSize == 'weekly':
+                ndays = 7
+            else:
+                ndays = 1
+            parts.append({'key' : key, 'label' : label, 'ds' : ds, 'ndays' : ndays, 'i0' : idx_tval, 'i1' : idx_tval + 1})
+
+        return parts
+
+    def writePartition(self, part, dimsData, varsData, timeD, nemoTimes, fnPattern, sCalendarType='noleap'):
+        """
+         Escribe los archivos de forzamientos (uno por variable) del periodo 'part' (ver forcingPartitions).
+         'nemoTimes' son los valores de dimsData['time'] convertidos con dateToNemoCalendar.
+         Se hace una excepcion para la variable radsw, pues estos datos se guardan con una periodicidad diaria,
+         a diferencia de las demas variables que son cada "timeD" hrs.
+        """
+        lVars = self.getConfigValueVL('vars')
+        vUnit = self.getConfigValueVL('units')
+        vLN = self.getConfigValueVL('longnames')
+        tSize = dimsData['time'][:].size
+        dfD = ((24 / timeD) - 1)
+        ds = part['ds']
+
+        # timeVD contiene los valores temporales para el periodo que se esta trabajando.
+        # espaciado cada "timeD" horas
+        timeVD = []
+        timeVDD = []
+        for t in range(0,(part['ndays']*24) / timeD):
+            timeVD.append( self.dateToNemoCalendar(ds + dt.timedelta(hours=timeD * t),sCalendarType) )
+        # timeVDD contiene los valores temporales para el periodo, espaciado en dias
+        for t in range(0,part['ndays']):
+            timeVDD.append( self.dateToNemoCalendar(ds + dt.timedelta(days=1.0*t) , sCalendarType) )
+        timeVD = np.array(timeVD, ndmin=1)
+        timeVDD = np.array(timeVDD, ndmin=1)
+
+        for var in self.variablesRename.keys():
+            log.info('Procesando variable : ' + var + ' periodo ' + part['label'])
+            ncFile = netcdfFile.netcdfFile()
+            ncFile.createFile(fnPattern.format(var=self.variablesRename[var], period=part['label']))
+
+            # Crear dimensiones y sus variables para referencia.
+            ncFile.createDims({'time':None , 'lat' : dimsData['lat'].size , 'lon' : dimsData['lon'].size})
+            dimVars = { 'time' : { 'dimensions': ['time']  , 'attributes' : {'units':'days since 1950-01-01 00:00:00', 'time_origin' : '1950-01-01 00:00:00', 'calendar' : 'noleap'} , 'dataType' : 'f8' }  
+                       ,'lat' :  { 'dimensions': ['lat']   , 'attributes' : {'units':'degree_north'} , 'dataType' : 'f8' }  
+                       ,'lon' :  { 'dimensions': ['lon']   , 'attributes' : {'units':'degree_east'}  , 'dataType' : 'f8' }  }
+            ncFile.createVars(dimVars)
+            # Salvar datos de variables de dimension.
+            if var == 'dswrfsfc':
+                ncFile.saveData({'time':timeVDD,'lat' : dimsData['lat'], 'lon' : dimsData['lon']})
+            else:
+                ncFile.saveData({'time':timeVD,'lat' : dimsData['lat'], 'lon' : dimsData['lon']})
+            # Indice de el arreglo units y long names
+            dindex = lVars.index(var)
+            # Crear la definicion de la variable en el archivo.
+            ncFile.createVars({self.variablesRename[var] : {'dimensions' : ['time','lat','lon'] , 'attributes' : {'units' : vUnit[dindex], 'long_name' : vLN[dindex] , '_FillValue' : 9.999e+20 } , 'dataType' : 'f4' } })
+
+            # Salvar Datos de la variable en su archivo correspondiente.
+            if var != 'dswrfsfc':
+                for N in range(part['i0'], part['i1']):
+                    # Localizar en que indice salvar el dato: 
+                    idx = (np.abs(timeVD - nemoTimes[N])).argmin()
+                    log.info('Salvando en el indice ' + str(idx) + ' timeVD: ' + str(timeVD[idx]) + '  N=' + str(N+1))
+                    ncFile.saveDataS(self.variablesRename[var],varsData[var][N][:][:],(idx))
+                    if N == 0:
+                        for di in range(0,idx):
+                            ncFile.saveDataS(self.variablesRename[var],varsData[var][N][:][:],(di))
+                    if N >= (tSize - 1):
+                        for di in range(idx,len(timeVD)):
+                            ncFile.saveDataS(self.variablesRename[var],varsData[var][N][:][:],(di))
+            else:
+                # Promedios diarios de grupos de (dfD+1) registros contados desde el inicio de la corrida, se
+                # escriben los grupos completos con algun registro en la particion. Un dia incompleto al final
+                # de la corrida no se promedia (no tiene el ciclo diurno completo), se rellena con el ultimo
+                # dia completo.
+                #TODO: Verificar que se estan haciendo promedios diarios, las fechas: dimsData['time'][n0] .. dimsData['time'][n0+dfD] deben pertenecer
+                #      al mismo dia.
+                gLast = (tSize / (dfD + 1)) - 1
+                written = []
+                for g in range(part['i0'] / (dfD + 1), min((part['i1'] - 1) / (dfD + 1), gLast) + 1):
+                    n0 = g * (dfD + 1)
+                    idxD = ( np.abs( timeVDD - nemoTimes[n0] ) ).argmin() 
+                    dataDaily = self.dailyMean(varsData[var], n0, dfD)
+                    fechastr = ' , '.join([ str(nemoTimes[c]) for c in range(n0, n0 + dfD + 1) ])
+                    ncFile.saveDataS(self.variablesRename[var], dataDaily ,(idxD)) 
+                    log.info('Haciendo promedio diario para radsw con fechas : ' + fechastr)
+                    log.info('Salvando en el indice : ' + str(idxD))
+                    written.append((idxD, dataDaily))
+
+                if len(written) == 0 and gLast >= 0:
+                    # La particion solo tiene el dia incompleto del final, se llena con el ultimo dia completo.
+                    log.info('Particion ' + part['label'] + ' sin dias completos, se rellena con el ultimo dia completo, radsw')
+                    written.append((0, self.dailyMean(varsData[var], gLast * (dfD + 1), dfD)))
+                    ncFile.saveDataS(self.variablesRename[var], written[0][1], (0))
+                elif len(written) == 0:
+                    log.warning('No hay ningun dia completo para el promedio diario de radsw.')
+
+                # Rellenar registros de datos al inicio y al final de cada archivo 
+                if len(written) > 0:
+                    log.info('Rellenando inicio y final de archivo, radsw')
+                    for di in range(0,written[0][0]):
+                        ncFile.saveDataS(self.variablesRename[var],written[0][1],(di))
+                    for di in range(written[-1][0] + 1,len(timeVDD)):
+                        ncFile.saveDataS(self.variablesRename[var],written[-1][1],(di))
+            ncFile.closeFile()
+
+        return 0
+
+    def dailyMean(self, data, n0, dfD):
+        """
+         Promedio de los registros data[n0] .. data[n0+dfD] (un dia completo).
+         La suma se acumula en float64, el promedio se regresa en la precision de salida (forcingDType).
+        """
+        dataDaily = data[n0:n0 + dfD + 1].sum(axis=0, dtype=np.float64)
+        return (dataDaily / float(dfD + 1)).astype(forcingDType)
+
     def makeForcingCoreBulk(self,dimsData,varsData,timeD , sFileSize='yearly'):
         """
          dimsData es un <python dict> con el siguiente formato:
@@ -172,162 +334,72 @@ class nemoForcing(gfsConfig):
          varsData es un <python dict> con el siguiente formato:
           {'var1' : values , 'var2' : values, ...}
 
+         Los arreglos de varsData deben venir en forcingDType (float32), el mismo tipo de las variables de salida.
+
          timeD Indica a cada cuantas horas vienen los datos en varsData, puede ser @ 3hrs, 6hrs, 12hrs
 
-         La funcion hace un ciclo con los valores de la dimension temporal, se obtiene el mes y el ano al que pertenece ese instante
-         cada vez que el mes, en el siguiente instante de tiempo, se crea un nuevo archivo con datos "mensuales" o "anuales" 
-         Se hace una excepcion para la variable radsw, pues estos datos se guardan con una periodicidad diaria, a diferencia de las 
-         demas variables que son cada 6hrs. 
-        """
-        currentMFile = None
-        ncFiles = {}
-        lVars = self.getConfigValueVL('vars')
-        vUnit = self.getConfigValueVL('units')
-        vLN = self.getConfigValueVL('longnames')
+         sFileSize indica el periodo de cada archivo de salida: 'daily', 'weekly', 'monthly' o 'yearly'.
 
+         Se calculan primero todas las particiones (periodo -> rango de indices en la dimension temporal) con
+         forcingPartitions, y despues se escribe cada una con writePartition. El nombre de los archivos se toma
+         de la llave 'fnpattern' del archivo de configuracion y las particiones se escriben en paralelo con
+         'nprocs' procesos.
+        """
+        global partitionJob
         sCalendarType = 'noleap'
-        
-        N = 0 
-        RADSWC = 0 
-        dfD = ((24 / timeD) - 1)
-        # Ciclo en la variable de dimension de tiempo: 
-        for idx_tval,tval in enumerate(dimsData['time'][:]):
-            # Convertir el valor tval a datetime.
-            # El formato ordinal de python es prolectic gregorian, por lo que se le resta un dia para ajustarlo
-            # del formato standard gregorian del que vienen los datos en nomads.
-            #tvaldate = dt.datetime.fromordinal(int(tval)) + dt.timedelta(days=tval%1) - dt.timedelta(days=1)
-            tvaldate = self.mtDToDatetime(tval) 
-            tvaldate_year = tvaldate.year 
-            tvaldate_month = tvaldate.month
-            # 
-            # Crear archivos de salida, segun corresponda a la fecha actual.
-            # Se crearan archivos mensuales o anuales de datos.
-            #
-            compareVarDummyForFileSize = tvaldate.year if (sFileSize == 'yearly') else tvaldate.month
-
-            if currentMFile == None or currentMFile != compareVarDummyForFileSize:
-
-                # Crear el archivo mensual o anual segun coresponda
-                if sFileSize == 'yearly':
-                    currentMFile = tvaldate.year 
-                else:
-                    currentMFile = tvaldate.month
-
-                # Crear valores de dimension para el actual mes
-                # ds es el primer dia del (mes o ano) del archivo currentMFile
-                if sFileSize == 'yearly':
-                    ds = dt.datetime(tvaldate.year, 1,1) 
-                else: 
-                    ds = dt.datetime(tvaldate_year,tvaldate_month,1)
-
-                nm = (tvaldate_month + 1) if tvaldate_month < 12 else 1
-                ny = tvaldate_year if tvaldate_month < 12 else (tvaldate_year + 1)
-                de = dt.datetime(ny,nm,1) 
-
-                # Tamano de la dimension temporal de este periodo, segun el calendario 
-                # que se utilize 
-                if sFileSize == 'yearly':
-                    sFileTDimSize = self.dateToNemoCalendar(tvaldate,sCalendarType,'yearLen')
-                else:
-                    sFileTDimSize = self.dateToNemoCalendar(tvaldate,sCalendarType,'monthLen')
-
-                # timeVD contiene los valores temporales para el (mes o ano) que se esta trabajando.
-                # espaciado cada "timeD" horas
-                timeVD=[]
-                timeVDD= []
-                for t in range(0,(sFileTDimSize*24) / timeD):
-                    #timeVD.append( self.datetime2matlabdn( ds + dt.timedelta(hours=6.0*t) + dt.timedelta(days=1) ) ) 
-                    timeVD.append( self.dateToNemoCalendar(ds + dt.timedelta(hours=timeD * t),sCalendarType) )
-
-                # timeVDD contiene los valores temporales para el (mes o ano), espaciado en dias 
-                for t in range(0,sFileTDimSize):
-                    #timeVDD.append( self.datetime2matlabdn( ds + dt.timedelta(days=1*t) + dt.timedelta(days=1) ) )
-                    timeVDD.append( self.dateToNemoCalendar(ds + dt.timedelta(days=1.0*t) , sCalendarType) )
-                #
-                # Crear archivos netcdf a los cuales se descargaran los datos.
-                for var in self.variablesRename.keys():
-                    log.info('Procesando variable : ' + var)
-                    ncFiles[var] = netcdfFile.netcdfFile()
-                    if sFileSize == 'yearly':
-                        ncFiles[var].createFile('drowned_' + self.variablesRename[var] + '_GFS_y' + str(tvaldate.year) + '.nc' )
-                    else:
-                        ncFiles[var].createFile('drowned_' + self.variablesRename[var] + '_GFS_y' + str(tvaldate.year) + '_M' + ("%02d"%tvaldate.month) + '.nc' )
-
-                    # Crear dimensiones y sus variables para referencia.
-                    ncFiles[var].createDims({'time':None , 'lat' : dimsData['lat'].size , 'lon' : dimsData['lon'].size})
-                    dimVars = { 'time' : { 'dimensions': ['time']  , 'attributes' : {'units':'days since 1950-01-01 00:00:00', 'time_origin' : '1950-01-01 00:00:00', 'calendar' : 'noleap'} , 'dataType' : 'f8' }  
-                               ,'lat' :  { 'dimensions': ['lat']   , 'attributes' : {'units':'degree_north'} , 'dataType' : 'f8' }  
-                               ,'lon' :  { 'dimensions': ['lon']   , 'attributes' : {'units':'degree_east'}  , 'dataType' : 'f8' }  }
-                    ncFiles[var].createVars(dimVars)
-                    # Salvar datos de variables de dimension.
-                    # 
-                    if var == 'dswrfsfc':
-                        ncFiles[var].saveData({'time':np.array(timeVDD),'lat' : dimsData['lat'], 'lon' : dimsData['lon']})
-                    else:
-                        ncFiles[var].saveData({'time':np.array(timeVD),'lat' : dimsData['lat'], 'lon' : dimsData['lon']})
-                    # Indice de el arreglo units y long names
-                    dindex = lVars.index(var)
-                    # Crear la definicion de la variable en el archivo.
-                    ncFiles[var].createVars({self.variablesRename[var] : {'dimensions' : ['time','lat','lon'] , 'attributes' : {'units' : vUnit[dindex], 'long_name' : vLN[dindex] , '_FillValue' : 9.999e+20 } , 'dataType' : 'f4' } })
-             
-            # Salvar Dato de variable en su archivo correspondiente.
-            for var in self.variablesRename.keys():
-                if var != 'dswrfsfc':
-                    # Localizar en que indice salvar el dato: 
-                    idx = (np.abs(timeVD - self.dateToNemoCalendar(tvaldate,sCalendarType))).argmin()
-                    log.info('Salvando en el indice ' + str(idx) + ' timeVD: ' + str(timeVD[idx]) + '  tvaldate : ' + str(tvaldate) + '  N=' + str(N+1))
-                    #ncFiles[var].saveData({self.variablesRename[var] : varsData})
-                    ncFiles[var].saveDataS(self.variablesRename[var],varsData[var][N][:][:],(idx))
-                    if idx_tval == 0:
-                        for di in range(0,idx):
-                            ncFiles[var].saveDataS(self.variablesRename[var],varsData[var][N][:][:],(di))
-                    if idx_tval >= (dimsData['time'][:].size - 1):
-                        for di in range(idx,len(timeVD)):
-                            ncFiles[var].saveDataS(self.variablesRename[var],varsData[var][N][:][:],(di))
-                else:
-                    if RADSWC >= dfD: 
-                        #TODO: Verificar que se estan haciendo promedios diarios, las fechas: dimsData['time'][N-dfD] .. dimsData['time'][N] deben pertenecer
-                        #      al mismo dia.
-                        idxD = ( np.abs( timeVDD - self.dateToNemoCalendar(self.mtDToDatetime(dimsData['time'][N - dfD ]), sCalendarType) ) ).argmin() 
-                        dataDaily = 0
-                        fechastr = ''
-                        divFactor = 0
-                        for c in range(0,dfD+1):
-                            if True:       #not (varsData[var][N - c][:][:] == 0).all():                       # Some registers contain all zeros normally  
-                                dataDaily = dataDaily  +  varsData[var][N - c][:][:]
-                                divFactor = divFactor + 1.0 
-                                fechastr = str(self.dateToNemoCalendar(self.mtDToDatetime(dimsData['time'][ N -c ]),sCalendarType)) + ' , ' + fechastr 
-                        dataDaily = dataDaily / float(divFactor)
-                        #dataDaily = ( varsData[var][N][:][:] + varsData[var][N-1][:][:] + varsData[var][N-2][:][:] + varsData[var][N-3][:][:] ) / 4.0
-                        ncFiles[var].saveDataS(self.variablesRename[var], dataDaily ,(idxD)) 
-                        #fechastr = str(self.dateToNemoCalendar(self.mtDToDatetime(dimsData['time'][N-3]),sCalendarType)) + ' ' + \
-                        #           str(self.dateToNemoCalendar(self.mtDToDatetime(dimsData['time'][N-2]),sCalendarType)) + ' ' + \
-                        #           str(self.dateToNemoCalendar(self.mtDToDatetime(dimsData['time'][N-1]),sCalendarType)) + ' ' + \
-                        #           str(self.dateToNemoCalendar(self.mtDToDatetime(dimsData['time'][N]),sCalendarType))  
-                        log.info('Haciendo promedio diario para radsw con fechas : ' + fechastr)
-                        log.info('Salvando en el indice : ' + str(idxD))
-
-                        # Rellenar registros de datos al inicio y al final del archivo 
-                        if idx_tval == dfD:
-                            log.info('Rellenando inicio de archivo, radsw')
-                            for di in range(0,idxD):
-                                ncFiles[var].saveDataS(self.variablesRename[var],dataDaily,(di))
-                        if idx_tval >= int(dimsData['time'][:].size / (dfD+1)) * (dfD+1) - 1:
-                            log.info('Rellenando final de archivo, radsw')
-                            for di in range(idxD,len(timeVDD)):
-                                ncFiles[var].saveDataS(self.variablesRename[var],dataDaily,(di))                        
-                        
-            # Contador indice en variable temporal para datos @"timeD"hrs            
-            N = N + 1 
-            # Contador indice en variable temporal para "radsw", @24 hrs.
-            RADSWC = RADSWC + 1
-            if RADSWC > dfD:
-                RADSWC = 0
-        
+
+        fnPattern = self.getConfigValue('fnpattern').strip()
+        if fnPattern == '':
+            fnPattern = 'drowned_{var}_GFS_{period}.nc'
+        nprocs = self.getConfigValue('nprocs').strip()
+        nprocs = int(nprocs) if nprocs != '' else 1
+
+        timeVals = dimsData['time'][:]
+        parts = self.forcingPartitions(timeVals, sFileSize, sCalendarType)
+        nemoTimes = np.array(self.dateToNemoCalendar(np.array([ self.mtDToDatetime(t) for t in timeVals ]), sCalendarType), ndmin=1)
+        log.info('makeForcingCoreBulk: ' + str(len(parts)) + ' particiones: ' + ', '.join([ p['label'] for p in parts ]))
+
+        if nprocs > 1 and len(parts) > 1:
+            # Los procesos hijos heredan partitionJob (fork), sin copiar los datos.
+            # Se limpia siempre, para no retener los arreglos si la escritura falla.
+            partitionJob = (self, parts, dimsData, varsData, timeD, nemoTimes, fnPattern, sCalendarType)
+            try:
+                pool = multiprocessing.Pool(min(nprocs, len(parts)))
+                try:
+                    out = pool.map(runPartitionJob, range(len(parts)))
+                finally:
+                    pool.close()
+                    pool.join()
+            finally:
+                partitionJob = None
+        else:
+            # En serie las excepciones se propagan, como antes.
+            out = [ self.writePartition(p, dimsData, varsData, timeD, nemoTimes, fnPattern, sCalendarType) for p in parts ]
+
+        if any([ o != 0 for o in out ]):
+            log.error('makeForcingCoreBulk: Fallo la escritura de alguna particion.')
+            return -1
         log.info('makeForcingCoreBulk: Informacion salvada.')
         return 0
-        
-   
-   
-    
-    
\ No newline at end of file
+
+
+# Tipo de dato de los arreglos de trabajo y de las variables de los archivos de forzamientos ('f4').
+# Los datos crudos de GFS vienen en float32, se mantienen asi en todo el proceso.
+forcingDType = np.float32
+
+# Particiones soportadas por makeForcingCoreBulk.
+partitionTypes = ['daily', 'weekly', 'monthly', 'yearly']
+
+# Trabajo de escritura de particiones en curso, compartido con los procesos hijos de makeForcingCoreBulk.
+partitionJob = None
+
+def runPartitionJob(pIdx):
+    """
+     Escribe la particion pIdx del trabajo partitionJob. Funcion de modulo para poder usarse con multiprocessing.
+    """
+    myForc, parts, dimsData, varsData, timeD, nemoTimes, fnPattern, sCalendarType = partitionJob
+    try:
+        return myForc.writePartition(parts[pIdx], dimsData, varsData, timeD, nemoTimes, fnPattern, sCalendarType)
+    except Exception:
+        log.exception('runPartitionJob: Fallo la particion ' + parts[pIdx]['label'])
+        return -1
@@ -0,0 +1,122 @@
+"""
+ Clases:
+  sliceCache : Cache local en disco de los dias extraidos (selDRange) de los archivos crudos GFS.
+               Se utiliza para la ventana historica 'hdays' de doGFScore_bulk, de forma que cada
+               dia historico se lea y decodifique una sola vez del archivo crudo.
+
+ Cada entrada es un directorio con bloques .npy por variable (float32), su mascara si tiene valores
+ enmascarados, y los valores de tiempo:
+  <cachedir>/<llave>/time.npy
+  <cachedir>/<llave>/<var>.npy
+  <cachedir>/<llave>/<var>_mask.npy
+ Las banderas de registros vacios (ver dataValidation) no se guardan, dependen de la configuracion y se
+ calculan de nuevo al leer.
+
+ La llave se construye con la identidad del archivo crudo (ruta, tamano, fecha de modificacion) y
+ la fecha del dia extraido. Las entradas se leen como memmap y se descartan por LRU cuando el tamano
+ total del cache rebasa el limite configurado.
+
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import logging as log
+import numpy as np
+# own libs
+import nemoForcingMaker
+
+
+class sliceCache():
+        """
+         Clase sliceCache
+         Guarda y recupera dias extraidos de archivos crudos, como bloques .npy por variable.
+        """
+        cacheDir = None
+        maxSize = 0
+
+        def __init__(self, cacheDir, maxSizeMB=2000):
+            self.cacheDir = cacheDir
+            self.maxSize = int(maxSizeMB) * 1024 * 1024
+            if not os.path.exists(self.cacheDir):
+                os.makedirs(self.cacheDir)
+
+        def entryKey(self, rawFile, dDate):
+            """
+             Llave de la entrada para el dia 'dDate' (datetime) extraido del archivo 'rawFile'.
+            """
+            st = os.stat(rawFile)
+            ident = '|'.join([os.path.abspath(rawFile), str(st.st_size), str(int(st.st_mtime)), dDate.strftime('%Y%m%d')])
+            return hashlib.md5(ident).hexdigest()
+
+        def get(self, rawFile, dDate, lVars):
+            """
+             Regresa (timeV, {'var' : datos}) si el dia 'dDate' del archivo 'rawFile'
+             se encuentra en el cache con todas las variables de 'lVars', en otro caso regresa None.
+             Los datos se regresan como memmap de solo lectura (numpy.ma si tienen mascara).
+            """
+            ePath = os.path.join(self.cacheDir, self.entryKey(rawFile, dDate))
+            if not os.path.isdir(ePath):
+                return None
+            try:
+                timeV = np.load(os.path.join(ePath, 'time.npy'))
+                data = {}
+                for var in lVars:
+                    data[var] = np.load(os.path.join(ePath, var + '.npy'), mmap_mode='r')
+                    if os.path.exists(os.path.join(ePath, var + '_mask.npy')):
+                        data[var] = np.ma.array(data[var], mask=np.load(os.path.join(ePath, var + '_mask.npy')))
+            except (IOError, ValueError), e:
+                log.warning('sliceCache: Entrada incompleta o invalida ' + ePath + ' : ' + str(e))
+                return None
+            # Marcar la entrada como usada recientemente (LRU).
+            os.utime(ePath, None)
+            log.info('sliceCache: Dia ' + dDate.strftime('%Y-%m-%d') + ' de ' + rawFile + ' leido del cache.')
+            return timeV, data
+
+        def put(self, rawFile, dDate, timeV, data):
+            """
+             Guarda en el cache el dia 'dDate' del archivo 'rawFile'.
+             'data' es un <python dict> con los bloques (tiempo, lat, lon) de cada variable, tal como se leyeron
+             del archivo crudo (numpy.ma si tienen valores enmascarados).
+            """
+            ePath = os.path.join(self.cacheDir, self.entryKey(rawFile, dDate))
+            if os.path.isdir(ePath):
+                return 0
+            # Se escribe en un directorio temporal y se renombra, para no dejar entradas a medias.
+            tmpPath = tempfile.mkdtemp(prefix='.tmp', dir=self.cacheDir)
+            try:
+                np.save(os.path.join(tmpPath, 'time.npy'), np.asarray(timeV))
+                for var in data.keys():
+                    np.save(os.path.join(tmpPath, var + '.npy'), np.asarray(np.ma.filled(data[var], 0), dtype=nemoForcingMaker.forcingDType))
+                    if np.ma.getmask(data[var]) is not np.ma.nomask and np.ma.getmask(data[var]).any():
+                        np.save(os.path.join(tmpPath, var + '_mask.npy'), np.ma.getmaskarray(data[var]))
+                os.rename(tmpPath, ePath)
+            except (IOError, OSError), e:
+                log.warning('sliceCache: No se pudo guardar la entrada ' + ePath + ' : ' + str(e))
+                shutil.rmtree(tmpPath, True)
+                return -1
+            self.evict()
+            return 0
+
+        def evict(self):
+            """
+             Elimina las entradas usadas menos recientemente hasta que el cache quede debajo de maxSize.
+            """
+            entries = []
+            total = 0
+            for e in os.listdir(self.cacheDir):
+                ePath = os.path.join(self.cacheDir, e)
+                if e.startswith('.tmp') or not os.path.isdir(ePath):
+                    continue
+                eSize = sum([os.path.getsize(os.path.join(ePath, f)) for f in os.listdir(ePath)])
+                entries.append((os.path.getmtime(ePath), eSize, ePath))
+                total = total + eSize
+            entries.sort()
+            for mtime, eSize, ePath in entries:
+                if total <= self.maxSize:
+                    break
+                log.info('sliceCache: Eliminando entrada ' + ePath)
+                shutil.rmtree(ePath, True)
+                total = total - eSize
+            return total
@@ -0,0 +1,59 @@
+"""
+ Pruebas de dataValidation: deteccion y reparacion de registros vacios.
+"""
+
+import unittest
+import numpy as np
+# Own libs
+import dataValidation
+
+
+class dataValidationTest(unittest.TestCase):
+
+        def makeStack(self):
+            # 8 registros @3hrs de radiacion de onda corta, de noche (registros 1 y 2) todo es cero.
+            stack = np.ones((8, 3, 4), np.float32) * 100.0
+            stack[1] = 0.0
+            stack[2] = 0.0
+            return stack
+
+        def testNightZerosNotEmpty(self):
+            stack = self.makeStack()
+            flags = dataValidation.emptyRecords(stack)
+            self.assertTrue((flags == dataValidation.REC_OK).all())
+
+        def testConstCheckOptIn(self):
+            stack = self.makeStack()
+            flags = dataValidation.emptyRecords(stack, True)
+            self.assertEqual(flags[1], dataValidation.REC_CONSTANT)
+            self.assertEqual(flags[2], dataValidation.REC_CONSTANT)
+
+        def testMaskedAndNaN(self):
+            stack = np.ma.array(self.makeStack())
+            stack[4] = np.ma.masked
+            stack[5, 0, 0] = np.nan
+            flags = dataValidation.emptyRecords(stack)
+            self.assertEqual(flags[4], dataValidation.REC_MASKED)
+            self.assertEqual(flags[5], dataValidation.REC_NAN)
+            self.assertEqual(flags[1], dataValidation.REC_OK)
+
+        def testRepairKeepsNightZeros(self):
+            stack = self.makeStack()
+            stack[5] = np.nan
+            flags = dataValidation.emptyRecords(stack)
+            report = dataValidation.repairRecords(stack, flags, np.arange(8) * 3 / 24.0, 'linear', 8)
+            self.assertEqual([ r['index'] for r in report ], [5])
+            self.assertTrue((stack[1] == 0).all())
+            self.assertTrue((stack[2] == 0).all())
+            self.assertTrue(np.allclose(stack[5], 100.0))
+
+        def testRepairLinear(self):
+            stack = np.arange(4, dtype=np.float32).reshape(4, 1, 1) * np.ones((4, 2, 2), np.float32)
+            stack[2] = np.nan
+            flags = dataValidation.emptyRecords(stack)
+            dataValidation.repairRecords(stack, flags, np.array([0.0, 1.0, 2.0, 3.0]), 'linear')
+            self.assertTrue(np.allclose(stack[2], 2.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+ Union de la dimension temporal de varias fuentes de datos crudos (analisis, ciclos de pronostico,
+ FNL, GFS_HD) en un solo eje de tiempo.
+
+ Cada fuente se describe con un <python dict> que contiene al menos:
+  { 'time' : valores de tiempo de los registros de la fuente (dias, formato ordinal/datenum),
+    'priority' : prioridad de la fuente, en tiempos repetidos gana la de mayor prioridad }
+ Las demas llaves del diccionario no se usan aqui, sirven al codigo que lee los datos.
+
+ mergeSources resuelve los traslapes y el eje temporal final en una sola pasada vectorizada sobre los
+ tiempos de todas las fuentes. Con sourceRecords se obtienen, por fuente, los registros que sobreviven,
+ para leerlos en bloque una sola vez y sin leer registros que despues se descartan.
+
+"""
+
+import logging as log
+import numpy as np
+
+
+def mergeSources(sources, timeStep=None):
+    """
+     Une los ejes de tiempo de 'sources' (ver arriba).
+     Los tiempos se comparan redondeados al minuto. En tiempos repetidos gana la fuente con mayor
+     'priority', y con igual prioridad la que aparezca primero en 'sources'.
+     'timeStep' (horas) restringe el eje final a los instantes multiplos de timeStep desde las 00 hrs,
+     por ejemplo 6 para unir FNL @6hrs con GFS_HD @3hrs.
+
+     Regresa un <python dict>:
+      { 'time'   : eje de tiempo final (ordenado),
+        'source' : indice en 'sources' de la fuente de cada registro,
+        'record' : indice del registro dentro de su fuente }
+    """
+    allT = []
+    allS = []
+    allR = []
+    allP = []
+    for k, src in enumerate(sources):
+        tV = np.asarray(np.ma.filled(src['time'], np.nan), dtype=np.float64).ravel()
+        allT.append(tV)
+        allS.append(np.zeros(tV.size, np.int32) + k)
+        allR.append(np.arange(tV.size))
+        allP.append(np.zeros(tV.size) + src['priority'])
+    if len(allT) == 0:
+        return {'time' : np.zeros(0), 'source' : np.zeros(0, np.int32), 'record' : np.zeros(0, np.int64)}
+    allT = np.concatenate(allT)
+    allS = np.concatenate(allS)
+    allR = np.concatenate(allR)
+    allP = np.concatenate(allP)
+
+    keep = ~np.isnan(allT)
+    keyT = np.zeros(allT.size, np.int64)
+    keyT[keep] = np.round(allT[keep] * 1440.0).astype(np.int64)
+    if timeStep is not None:
+        keep = keep & (keyT % int(round(timeStep * 60)) == 0)
+    keepI = np.flatnonzero(keep)
+
+    # Orden por tiempo y, en cada tiempo, por prioridad descendente (lexsort es estable).
+    order = keepI[np.lexsort((-allP[keepI], keyT[keepI]))]
+    first = np.ones(order.size, bool)
+    first[1:] = keyT[order][1:] != keyT[order][:-1]
+    sel = order[first]
+
+    log.info('mergeSources: ' + str(allT.size) + ' registros en ' + str(len(sources)) + ' fuentes, ' +
+             str(sel.size) + ' en el eje final.')
+    return {'time' : allT[sel], 'source' : allS[sel], 'record' : allR[sel]}
+
+
+def sourceRecords(merged, k):
+    """
+     Registros de la fuente k que sobreviven en 'merged' (ver mergeSources).
+     Regresa (pos, rec): posiciones en el eje final e indices de los registros en la fuente,
+     ambos en orden ascendente, para hacer una sola lectura en bloque de la fuente.
+    """
+    pos = np.flatnonzero(merged['source'] == k)
+    return pos, merged['record'][pos]